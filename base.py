@@ -4,9 +4,23 @@ It defines abstract class for the io interface on raspberry plus some
 module function for getting RPi.GPIO and SMBus.
 """
 
+import abc
+import collections
 import logging
+import threading
 from exceptions import InvalidPortNumberError
 
+
+_log = logging.getLogger(__name__)
+_warn = _log.warning
+
+try:
+    _input = raw_input
+except NameError:
+    # Python 3
+    _input = input
+
+
 # TODO: get rid of no hardware mode and such no-device solutions because
 # it has no sense
 class Settings(object):
@@ -19,39 +33,174 @@ class Settings(object):
     # full emulation).
     NO_HARDWARE_ASK_INPUT = False
 
+    # When set and IS_NO_HARDWARE_MODE is set to True, reads from ports call
+    # it with port.Port object and return its result (self.HIGH or self.LOW)
+    # instead of asking for input. Meant for scripted emulation, eg. a
+    # function returning pre-generated values picked by port.number.
+    NO_HARDWARE_VALUE_CALLBACK = None
+
     # Time (ms) that value change on port must persist to treat it as value change.
+    # Raspberry GPIO passes it as bouncetime to RPi.GPIO, so bounces are
+    # filtered in the C library and never reach python. MCP23017 has no such
+    # option and debounces in its listener thread.
     READ_SWITCH_DEBOUNCE = 200
 
+    # MCP23017 only. When set to True callbacks are triggered as soon as the
+    # change is detected, and further changes on the port are ignored for
+    # READ_SWITCH_DEBOUNCE ms. Otherwise the change must persist for
+    # READ_SWITCH_DEBOUNCE ms before callbacks are triggered.
+    READ_SWITCH_IMMEDIATE = False
+
+    # Time (ms) for which MCP23017 GPIOA/GPIOB values read from the device
+    # are reused by following reads, so reading many ports in a row is one
+    # bus transaction. Any write drops the cached values. Longer time means
+    # older values may be returned, 0 disables the cache.
+    MCP_READ_CACHE_TTL = 1
+
+    # When set to True event callbacks are not called by the thread that
+    # detected the change (RPi.GPIO or MCP23017 listener thread), it only
+    # queues them. They are called in order by one separate thread, so slow
+    # callbacks do not delay detecting further changes.
+    DISPATCH_CALLBACKS_IN_THREAD = False
+
 
 _GPIO = None
 _BUS = None
 
+# Guards one-time libraries initialization. Getters may be called
+# concurrently, eg. from RPi.GPIO event callbacks running in its own thread.
+_INIT_LOCK = threading.Lock()
+
+# Guards every bus transaction, see _LockedBus.
+_BUS_LOCK = threading.Lock()
+
+
+class _LockedBus(object):
+    """SMBus doing one transaction at a time, returned by get_bus().
+
+    smbus2 selects the device with a separate ioctl before the transfer,
+    and releases the GIL in between. So with MCP23017 listener thread
+    reading one chip while another thread writes to other one, a transfer
+    could go to the wrong address. Only the methods used by this package
+    are provided.
+    """
+
+    __slots__ = ('_bus',)
+
+    def __init__(self, bus):
+        self._bus = bus
+
+    def write_byte_data(self, address, register, value):
+        with _BUS_LOCK:
+            return self._bus.write_byte_data(address, register, value)
+
+    def read_i2c_block_data(self, address, register, length):
+        with _BUS_LOCK:
+            return self._bus.read_i2c_block_data(address, register, length)
+
+    def write_i2c_block_data(self, address, register, values):
+        with _BUS_LOCK:
+            return self._bus.write_i2c_block_data(address, register, values)
+
 
 def _initialize_pi_libs():
     global _BUS
     global _GPIO
-    try:
-        from smbus import SMBus
-        import RPi.GPIO as GPIO
-        _BUS = SMBus(1)
-        _GPIO = GPIO
-        GPIO.setmode(GPIO.BOARD)
-    except ImportError:
-        # When running in "NO HARDWARE" mode allow to not have smbus library
-        if not Settings.IS_NO_HARDWARE_MODE:
-            raise
+    with _INIT_LOCK:
+        if _BUS is not None and _GPIO is not None:
+            # Done by another thread while this one was waiting for the lock.
+            return
+        try:
+            try:
+                # Preferred, as it talks to the bus with fcntl.ioctl, which
+                # releases the GIL while waiting for the transfer. Threads
+                # not using the bus (eg. callbacks dispatcher) keep running
+                # meanwhile, bus transactions are serialized by _LockedBus.
+                from smbus2 import SMBus
+            except ImportError:
+                from smbus import SMBus
+            import RPi.GPIO as GPIO
+            _BUS = _LockedBus(SMBus(1))
+            _GPIO = GPIO
+            GPIO.setmode(GPIO.BOARD)
+        except ImportError:
+            # When running in "NO HARDWARE" mode allow to not have smbus library
+            if not Settings.IS_NO_HARDWARE_MODE:
+                raise
+
+
+# Default of configure() arguments, so None can still be set explicitly.
+_UNSET = object()
+
+
+def init(no_hardware=_UNSET):
+    """Initializes the hardware libraries upfront.
+
+    Calling it is optional, libraries are otherwise initialized on first
+    use. Interfaces keep references to RPi.GPIO and SMBus obtained when they
+    are created, so it is enough to call it once before creating them.
+
+    :param no_hardware: value for Settings.IS_NO_HARDWARE_MODE, see
+        configure()
+    """
+    configure(no_hardware=no_hardware)
+    if not Settings.IS_NO_HARDWARE_MODE:
+        _initialize_pi_libs()
+
+
+def _warn_no_hardware_read():
+    # Called on every read, skip the logging machinery when the record
+    # would be dropped anyway.
+    if _log.isEnabledFor(logging.WARNING):
+        _warn('No hardware mode, no read can be done.')
+
+
+def configure(
+        no_hardware=_UNSET,
+        ask_input=_UNSET,
+        debounce_ms=_UNSET,
+        value_callback=_UNSET,
+        switch_immediate=_UNSET,
+        read_cache_ms=_UNSET,
+        dispatch_in_thread=_UNSET):
+    """Sets many Settings at once.
+
+    Arguments not given keep the current Settings values, so eg.
+    configure(debounce_ms=100) changes only the debounce. It only assigns
+    Settings attributes, setting them directly has the same effect.
+
+    :param no_hardware: value for Settings.IS_NO_HARDWARE_MODE
+    :param ask_input: value for Settings.NO_HARDWARE_ASK_INPUT
+    :param debounce_ms: value for Settings.READ_SWITCH_DEBOUNCE
+    :param value_callback: value for Settings.NO_HARDWARE_VALUE_CALLBACK
+    :param switch_immediate: value for Settings.READ_SWITCH_IMMEDIATE
+    :param read_cache_ms: value for Settings.MCP_READ_CACHE_TTL
+    :param dispatch_in_thread: value for Settings.DISPATCH_CALLBACKS_IN_THREAD
+    """
+    values_by_name = (
+        ('IS_NO_HARDWARE_MODE', no_hardware),
+        ('NO_HARDWARE_ASK_INPUT', ask_input),
+        ('READ_SWITCH_DEBOUNCE', debounce_ms),
+        ('NO_HARDWARE_VALUE_CALLBACK', value_callback),
+        ('READ_SWITCH_IMMEDIATE', switch_immediate),
+        ('MCP_READ_CACHE_TTL', read_cache_ms),
+        ('DISPATCH_CALLBACKS_IN_THREAD', dispatch_in_thread),
+    )
+    for name, value in values_by_name:
+        if value is not _UNSET:
+            setattr(Settings, name, value)
 
 
 def get_bus():
-    global _BUS
-    if not _BUS and not Settings.IS_NO_HARDWARE_MODE:
+    # Lock-free fast path once initialized, _initialize_pi_libs() checks
+    # again under the lock.
+    if _BUS is None and not Settings.IS_NO_HARDWARE_MODE:
         _initialize_pi_libs()
     return _BUS
 
 
 def get_gpio():
-    global _GPIO
-    if not _GPIO and not Settings.IS_NO_HARDWARE_MODE:
+    if _GPIO is None and not Settings.IS_NO_HARDWARE_MODE:
         _initialize_pi_libs()
     return _GPIO
 
@@ -64,47 +213,96 @@ def register_on_cleanup(callback):
 
 
 def cleanup():
-    logging.debug('Starting the iowrap cleanup.')
+    _log.debug('Starting the iowrap cleanup.')
     for cleanup_callback in _cleanup_callbacks:
         cleanup_callback()
     if not Settings.IS_NO_HARDWARE_MODE:
         get_gpio().cleanup()
-    logging.debug('iowrap cleanup done.')
+    _log.debug('iowrap cleanup done.')
+
+
+# High and low port values. Module level constants, so internal code loads
+# them as globals. Also available as InOutInterface.HIGH/LOW.
+HIGH = 1
+LOW = 0
+
+# Input and output values used in underneath registry for tracking.
+# Small ints so they fit into a bytearray, 0 means not set yet.
+_INPUT = 1
+_OUTPUT = 2
+
+# Readable names of the in/out registry codes, for logging and debugging.
+_NAME = {_INPUT: 'INPUT', _OUTPUT: 'OUTPUT'}
+
+
+def _iter_bits(mask):
+    """Yields indexes of bits set in mask, lowest first."""
+    while mask:
+        lowest_bit = mask & -mask
+        yield lowest_bit.bit_length() - 1
+        mask ^= lowest_bit
 
 
+# Base class with abc.ABCMeta metaclass, declared this way so it works with
+# both python 2 and 3 syntax.
+_AbstractBase = abc.ABCMeta('_AbstractBase', (object,), {'__slots__': ()})
 
 
-class InOutInterface(object):
+class InOutInterface(_AbstractBase):
     """Abstract interface class.
 
     An interface should be understand as a controller of some number
     of specific ports.
 
-    All ports are 1-based indexed (for the sake of gpio docs).
+    All ports are 1-based indexed (for the sake of gpio docs). Internally
+    they are stored 0-based, so port number N lives under index N - 1.
     """
 
+    # No per-instance __dict__, derived classes declare their own slots.
+    __slots__ = (
+        '_ports',
+        '_in_out_registry',
+        '_input_mask',
+        '_output_mask',
+        '_ports_len',
+        '_get_value_fast',
+    )
+
     # Specifies input and output values used in underneath registry for
-    # tracking.
-    _INPUT = 'INPUT'
-    _OUTPUT = 'OUTPUT'
+    # tracking. See module level constants of the same names.
+    _INPUT = _INPUT
+    _OUTPUT = _OUTPUT
 
     # Specifies high and low port values used in underneath registry for
-    # tracking
-    HIGH = 1
-    LOW = 0
+    # tracking. Kept for API compatibility, see module level constants.
+    HIGH = HIGH
+    LOW = LOW
 
     def __init__(self, ports_count):
         # List of ports, filled with None values.
-        # Ports should be 1-based indexed therefore the number of elements is
-        # ports_count + 1, port with index 0 is not used.
+        # 0-based indexed, port number N is stored under index N - 1.
         # The proper ports should be initialized in derived classes.
-        self._ports = [None] * (ports_count + 1)
+        self._ports = [None] * ports_count
+
+        # Cached length of self._ports, used by port number validation which
+        # runs on every single read/write.
+        self._ports_len = ports_count
 
         # Tracks information of which port is treated as input or output.
         # After port initialization all values should be either
         # self._INPUT or self._OUTPUT.
-        # 1-based indexed.
-        self._in_out_registry = [None] * (ports_count + 1)
+        # 0-based indexed, same as self._ports.
+        self._in_out_registry = bytearray(ports_count)
+
+        # The same information as in self._in_out_registry kept as bitmaps,
+        # bit N is set when port number N is input (or output respectively).
+        # Used by the checks that run on every read/write.
+        self._input_mask = 0
+        self._output_mask = 0
+
+        # get_value bound once, so is_high/is_low reads skip the method
+        # lookup on every call.
+        self._get_value_fast = self.get_value
 
     def _initialize_ports(self):
         """Runs through all defined ports and initializes it.
@@ -117,45 +315,65 @@ class InOutInterface(object):
                 p.initialize()
 
     def _validate_port_number(self, port_number):
-        if port_number <= 0:
-            raise InvalidPortNumberError(
-                'Provided port number(%d) is not greater then 0.' % port_number)
-        if port_number >= len(self._ports):
+        if not 0 < port_number <= self._ports_len:
+            if port_number <= 0:
+                raise InvalidPortNumberError(
+                    'Provided port number(%d) is not greater then 0.'
+                    % port_number)
             raise InvalidPortNumberError(
                 'Provided port number(%d) is greater then highest '
-                'port number(%d)' % (port_number, len(self._ports)))
+                'port number(%d)' % (port_number, self._ports_len))
+
+    def _register_as_input(self, port_number):
+        """Tracks port as input, to be called by derived set_as_input."""
+        self._in_out_registry[port_number - 1] = _INPUT
+        self._input_mask |= 1 << port_number
+        self._output_mask &= ~(1 << port_number)
+
+    def _register_as_output(self, port_number):
+        """Tracks port as output, to be called by derived set_as_output."""
+        self._in_out_registry[port_number - 1] = _OUTPUT
+        self._output_mask |= 1 << port_number
+        self._input_mask &= ~(1 << port_number)
 
     def _validate_write_port_number(self, port_number):
-        if self._in_out_registry[port_number] == self._INPUT:
+        if port_number <= 0:
+            # Negative shift count would raise ValueError.
+            self._validate_port_number(port_number)
+        if self._input_mask >> port_number & 1:
             raise InvalidPortNumberError(
                 'Provided port number({}) is set as input, can not set value '
                 'for it.'.format(port_number))
 
     def _validate_listen_port_number(self, port_number):
-        if self._in_out_registry[port_number] == self._OUTPUT:
+        if port_number <= 0:
+            self._validate_port_number(port_number)
+        if self._output_mask >> port_number & 1:
             raise InvalidPortNumberError(
                 'Provided port number({}) is set as output, '
                 'can not listen for value on it.'.format(port_number))
 
-    def _check_no_hardware_port_value(self, port_number):
+    def _get_no_hardware_port_value(self, port_number):
         """Reads port value in IS_NO_HARDWARE_MODE.
 
-        In case NO_HARDWARE_ASK_INPUT equals False it will always 
+        Callers check Settings.IS_NO_HARDWARE_MODE themselves, so reads in
+        hardware mode do not pay for an extra method call.
+
+        Settings.NO_HARDWARE_VALUE_CALLBACK takes precedence over
+        NO_HARDWARE_ASK_INPUT. In case none of them is set it will always
         return self._LOW.
         """
-        if Settings.IS_NO_HARDWARE_MODE:
-            logging.warning('No hardware mode, no read can be done.')
-            if Settings.NO_HARDWARE_ASK_INPUT:
-                user_input = raw_input(
-                    'Enter value you\'d like your port (%s) to return '
-                    '(1 - high, 0 - low): ' % self.get_port(port_number))
-                if user_input == "1":
-                    return self.HIGH
-                else:
-                    return self.LOW
-            else:
-                return self.LOW
-        return None
+        _warn_no_hardware_read()
+        callback = Settings.NO_HARDWARE_VALUE_CALLBACK
+        if callback is not None:
+            return callback(self.get_port(port_number))
+        if Settings.NO_HARDWARE_ASK_INPUT:
+            user_input = _input(
+                'Enter value you\'d like your port (%s) to return '
+                '(1 - high, 0 - low): ' % self.get_port(port_number))
+            if user_input == "1":
+                return HIGH
+        return LOW
 
     def get_port(self, port_number):
         """Returns port.
@@ -163,7 +381,7 @@ class InOutInterface(object):
         :returns port.Port
         """
         self._validate_port_number(port_number)
-        return self._ports[port_number]
+        return self._ports[port_number - 1]
 
     def get_all_ports(self):
         """Returns all ports as 0-indexed list."""
@@ -173,47 +391,114 @@ class InOutInterface(object):
         """Returns collection of ports for given port numbers."""
         return [self.get_port(port_number) for port_number in port_numbers]
 
+    @abc.abstractmethod
     def get_value(self, port_number):
-        """Returns either self._HIGH or self._LOW."""
-        raise NotImplementedError
+        """Returns either self._HIGH or self._LOW.
+
+        Implementations must validate the port number (skipped when running
+        with python -O, as all hot path validation).
+        """
+
+    def get_values(self, port_numbers=None):
+        """Returns list of values for given port numbers.
+
+        When port numbers are not given values for all ports are returned,
+        in the same order as get_all_ports() returns ports. Derived classes
+        may override it to read many ports at once.
+        """
+        if port_numbers is None:
+            port_numbers = [p.number for p in self.get_all_ports()]
+        return [self.get_value(port_number) for port_number in port_numbers]
 
     def is_high(self, port_number):
-        self._validate_port_number(port_number)
-        return self.get_value(port_number) == self.HIGH
+        return self._get_value_fast(port_number) == HIGH
 
     def is_low(self, port_number):
-        self._validate_port_number(port_number)
-        return self.get_value(port_number) == self.LOW
+        return self._get_value_fast(port_number) == LOW
 
     def is_output(self, port_number):
         self._validate_port_number(port_number)
-        return self._in_out_registry[port_number] == self._OUTPUT
+        return self._output_mask >> port_number & 1 == 1
 
     def is_input(self, port_number):
         self._validate_port_number(port_number)
-        return self._in_out_registry[port_number] == self._INPUT
+        return self._input_mask >> port_number & 1 == 1
+
+    def iter_inputs(self):
+        """Yields numbers of ports set as inputs, in ascending order."""
+        return _iter_bits(self._input_mask)
 
+    def iter_outputs(self):
+        """Yields numbers of ports set as outputs, in ascending order."""
+        return _iter_bits(self._output_mask)
+
+    @abc.abstractmethod
     def set_high(self, port_number):
-        raise NotImplementedError
+        """Sets output port value to self.HIGH."""
 
+    @abc.abstractmethod
     def set_low(self, port_number):
-        raise NotImplementedError
+        """Sets output port value to self.LOW."""
+
+    def toggle(self, port_number):
+        """Inverts value of output port.
+
+        Derived classes may override it to skip reading the current value.
+        """
+        if self.is_high(port_number):
+            return self.set_low(port_number)
+        return self.set_high(port_number)
+
+    def set_output_high(self, port_number):
+        """Sets port as OUTPUT port with self.HIGH value.
+
+        Derived classes may override it to do both at once.
+        """
+        self.set_as_output(port_number)
+        return self.set_high(port_number)
+
+    def set_output_low(self, port_number):
+        """Sets port as OUTPUT port with self.LOW value.
+
+        Derived classes may override it to do both at once.
+        """
+        self.set_as_output(port_number)
+        return self.set_low(port_number)
+
+    def set_ports_high(self, port_numbers):
+        """Sets values of all given output ports to self.HIGH.
 
+        Derived classes may override it to write many ports at once.
+        """
+        for port_number in port_numbers:
+            self.set_high(port_number)
+        return self
+
+    def set_ports_low(self, port_numbers):
+        """Sets values of all given output ports to self.LOW.
+
+        Derived classes may override it to write many ports at once.
+        """
+        for port_number in port_numbers:
+            self.set_low(port_number)
+        return self
+
+    @abc.abstractmethod
     def set_as_output(self, port_number):
         """Sets port as OUTPUT port, which means it outputs some value.
 
         In other words port can be set to a certain value
         (not read value from it).
         """
-        raise NotImplementedError
 
+    @abc.abstractmethod
     def set_as_input(self, port_number):
         """Sets port as INPUT port, which means it awaits some input value.
 
         In other words you can read from it.
         """
-        raise NotImplementedError
 
+    @abc.abstractmethod
     def add_event(
             self,
             port_number,
@@ -225,7 +510,6 @@ class InOutInterface(object):
         1. Port object
         2. Current port value
         """
-        raise NotImplementedError
 
     def on_rising_detection(self, port_number, callback):
         self.add_event(
@@ -239,32 +523,165 @@ class InOutInterface(object):
             on_rising_callback=None,
             on_falling_callback=callback)
 
+    @abc.abstractmethod
     def clear_read_events(self, port_number):
-        raise NotImplementedError
+        """Removes all callbacks added for given port."""
+
+
+def _noop(*args):
+    pass
+
+
+def _get_trigger(callbacks):
+    """Returns single function calling all given callbacks.
+
+    The common cases (no callback, one callback) get no loop at all.
+    The callbacks are copied, so clearing them does not affect a dispatch
+    that is in progress.
+    """
+    if not callbacks:
+        return _noop
+    if len(callbacks) == 1:
+        return callbacks[0]
+    callbacks = tuple(callbacks)
+
+    def trigger(port, value):
+        for callback in callbacks:
+            callback(port, value)
+    return trigger
+
+
+class _CallbacksDispatcher(threading.Thread):
+    """Calls queued event callbacks, see DISPATCH_CALLBACKS_IN_THREAD."""
+
+    # Oldest events are dropped when callbacks can't keep up with more.
+    # The first dropped one is logged right away, the total when the queue
+    # is drained.
+    _MAX_QUEUED = 1024
+
+    def __init__(self):
+        super(_CallbacksDispatcher, self).__init__(
+            name='Event callbacks dispatcher')
+        # Appending and popping deque is thread safe, no lock needed.
+        self._queue = collections.deque(maxlen=self._MAX_QUEUED)
+        self._event = threading.Event()
+        # Number of events dropped because the queue was full, since the
+        # last drain. Guarded by the lock, events are pushed from both
+        # RPi.GPIO and MCP23017 listener threads.
+        self._dropped = 0
+        self._dropped_lock = threading.Lock()
+        self.daemon = True
+
+    def push(self, trigger, port, value):
+        queue = self._queue
+        if len(queue) >= self._MAX_QUEUED:
+            # Appending to full deque drops its oldest item. Only the first
+            # drop is logged here, not to slow down the pushing thread.
+            with self._dropped_lock:
+                self._dropped += 1
+                is_first = self._dropped == 1
+            if is_first:
+                _warn('Event callbacks queue is full, dropping oldest events.')
+        queue.append((trigger, port, value))
+        self._event.set()
+
+    def run(self):
+        queue = self._queue
+        event = self._event
+        while True:
+            event.wait()
+            # Cleared before draining, so events pushed meanwhile are not
+            # left in the queue until the next one.
+            event.clear()
+            while queue:
+                trigger, port, value = queue.popleft()
+                try:
+                    trigger(port, value)
+                except Exception:
+                    _log.exception('Event callback failed for: %s', port)
+            with self._dropped_lock:
+                dropped = self._dropped
+                self._dropped = 0
+            if dropped:
+                _warn('Event callbacks queue drained, %d events dropped.',
+                      dropped)
+
+
+_DISPATCHER = None
+_DISPATCHER_LOCK = threading.Lock()
+
+
+def dispatch_callbacks(trigger, port, value):
+    """Calls trigger(port, value) now or queues it for dispatcher thread."""
+    if not Settings.DISPATCH_CALLBACKS_IN_THREAD:
+        trigger(port, value)
+        return
+    global _DISPATCHER
+    if _DISPATCHER is None:
+        with _DISPATCHER_LOCK:
+            if _DISPATCHER is None:
+                dispatcher = _CallbacksDispatcher()
+                dispatcher.start()
+                _DISPATCHER = dispatcher
+    _DISPATCHER.push(trigger, port, value)
 
 
 class PortListener(object):
     """Decides "if" and "what" for triggering read events on inputs."""
 
+    __slots__ = (
+        'port',
+        'last_read_value',
+        '_rising_callbacks',
+        '_falling_callbacks',
+        '_callbacks_by_value',
+        '_triggers_by_value',
+    )
+
     def __init__(self, port):
         self.port = port
-        self.last_read_value = port.value
+        # Unknown until the first read, so creating the listener does not
+        # read the port.
+        self.last_read_value = None
         self._rising_callbacks = []
         self._falling_callbacks = []
 
+        # Callbacks to trigger by the port value read after the change, so
+        # picking them does not need any branching on the edge type.
+        self._callbacks_by_value = {
+            HIGH: self._rising_callbacks,
+            LOW: self._falling_callbacks,
+        }
+
+        # Same as above but with the callbacks folded into one function each,
+        # see _get_trigger(). Rebuilt whenever the callbacks change.
+        self._triggers_by_value = {}
+        self._rebuild_triggers()
+
+    def _rebuild_triggers(self):
+        self._triggers_by_value[HIGH] = _get_trigger(self._rising_callbacks)
+        self._triggers_by_value[LOW] = _get_trigger(self._falling_callbacks)
+
     def add_rising_callback(self, callback):
         self._rising_callbacks.append(callback)
+        self._rebuild_triggers()
 
     def add_falling_callback(self, callback):
         self._falling_callbacks.append(callback)
+        self._rebuild_triggers()
 
     def clear_callbacks(self):
-        self._rising_callbacks = []
-        self._falling_callbacks = []
+        # Truncate in place, self._callbacks_by_value refers to these lists.
+        del self._rising_callbacks[:]
+        del self._falling_callbacks[:]
+        self._rebuild_triggers()
 
     def get_callbacks_to_trigger(self):
+        """Returns callbacks to trigger, updating self.last_read_value."""
         raise NotImplementedError
 
     def trigger_callbacks(self, *args, **kwargs):
-        for callback in self.get_callbacks_to_trigger():
-            callback(self.port, self.last_read_value)
+        if self.get_callbacks_to_trigger():
+            value = self.last_read_value
+            dispatch_callbacks(
+                self._triggers_by_value[value], self.port, value)
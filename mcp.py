@@ -7,18 +7,28 @@ ports in a standardized way. It uses SMBus under the hood.
 """
 
 
+import contextlib
 import logging
 import threading
 import time
 
+from base import HIGH
 from base import InOutInterface
+from base import LOW
 from base import Settings
+from base import dispatch_callbacks
 from base import get_bus
+from base import get_gpio
 from base import register_on_cleanup
 from base import PortListener
 from port import Port
 
-from exceptions import Error
+
+_log = logging.getLogger(__name__)
+
+
+# Monotonic clock where available (python 3), used for read cache expiry.
+_monotonic = getattr(time, 'monotonic', time.time)
 
 
 # Tracks all created MCP23017 objects. It then allows to do a proper cleanup.
@@ -26,15 +36,59 @@ _REGISTRY = []
 
 
 def cleanup():
-    logging.debug('Starting iowrap.mcp cleanup.')
+    _log.debug('Starting iowrap.mcp cleanup.')
     for interface in _REGISTRY:
         interface.clear_all_read_events()
-    logging.debug('iowrap.mcp cleanup done.')
+    _log.debug('iowrap.mcp cleanup done.')
 
 
 register_on_cleanup(cleanup)
 
 
+# Single thread listening on ports of all MCP23017 interfaces, see
+# _MCP23017ListenerThread. Exists only when any port is listened to.
+_LISTENER_THREAD = None
+_LISTENER_THREAD_LOCK = threading.Lock()
+
+
+def _listen(interface):
+    """Makes the listener thread check ports of given interface.
+
+    Thread is started when there is none, eg. after the last interface
+    stopped listening, and also replaces a thread that died unexpectedly,
+    taking over its interfaces. It is called by add_event only when the
+    first callbacks are added for a port.
+    """
+    global _LISTENER_THREAD
+    with _LISTENER_THREAD_LOCK:
+        thread = _LISTENER_THREAD
+        if thread is None or not thread.is_alive():
+            _LISTENER_THREAD = _MCP23017ListenerThread()
+            if thread is not None:
+                for old_interface in list(thread._interfaces):
+                    _LISTENER_THREAD.add_interface(old_interface)
+            _LISTENER_THREAD.start()
+        _LISTENER_THREAD.add_interface(interface)
+
+
+def _stop_listening(interface):
+    """Stops checking ports of given interface.
+
+    The listener thread is stopped when it was the last interface.
+    """
+    global _LISTENER_THREAD
+    with _LISTENER_THREAD_LOCK:
+        thread = _LISTENER_THREAD
+        if thread is None:
+            return
+        thread.remove_interface(interface)
+        if thread.has_any_events():
+            return
+        _LISTENER_THREAD = None
+    # Outside of the lock, callbacks run by the thread may need it.
+    thread.stop()
+
+
 class MCP23017(InOutInterface):
     """Defines interface created by using MCP23017.
 
@@ -68,34 +122,89 @@ class MCP23017(InOutInterface):
     > bus.write_byte_data(0x20, 0x15, 0b00000001)
     > bus.write_byte_data(0x20, 0x15, int("0b00000001", 2))
 
-    TODO: consider the following:
-    To set the value for port all other 7 port values must be read first.
-    This is a lot of operations, the state of all ports could be saved
-    locally (as it was at the beginning). There is visible slow down because
-    of that, but so far it is enough for the needs.
+    To set the value for port all other 7 port values must be known too,
+    because the whole 8-bit register is written at once. They are taken from
+    the registers shadow kept locally, so no reads from the device are needed.
     """
 
-    # Defines names of first and second half of all 16 ports.
     # Sometimes it is preferred to use one interface and it's GPA or GPB part,
     # each containing 8 ports, instead of all 16 ports layer.
     # And of course each part has different registers to be set when setting
-    # value to port.
-    _PART_A = 'A'
-    _PART_B = 'B'
-
-    def __init__(self, address):
+    # value to port. Tables below are indexed by port_number - 1.
+
+    # Masks of the port bits within GPA or GPB register.
+    _BIT_MASKS = tuple(1 << (bit % 8) for bit in range(16))
+    # Write registers (OLATA/B).
+    _WRITE_REGISTERS = (0x14,) * 8 + (0x15,) * 8
+    # Setas registers (IODIRA/B), the ones under which port can be defined
+    # as input or output.
+    _SETAS_REGISTERS = (0x00,) * 8 + (0x01,) * 8
+    # Registers for setting pullup rezistor for inputs (GPPUA/B).
+    _PULLUP_REGISTERS = (0x0C,) * 8 + (0x0D,) * 8
+    # Registers enabling interrupt on change (GPINTENA/B).
+    _INTERRUPT_REGISTERS = (0x04,) * 8 + (0x05,) * 8
+    # Write registers by part name, see set_bank.
+    _BANK_WRITE_REGISTERS = {'A': 0x14, 'B': 0x15}
+
+    __slots__ = (
+        '_address',
+        '_bus',
+        '_bus_write',
+        '_registers',
+        '_gpio_cache',
+        '_batch_depth',
+        '_dirty_registers',
+        '_port_listeners',
+        '_listeners_version',
+        '_checked_values',
+        '_interrupt_port',
+        'use_pullup_rezistor',
+    )
+
+    def __init__(self, address, interrupt_port=None):
         """
         Creates new instance of interface with some address defined by I2C.
         It DOES NOT validate if an interface instance with the same address
         was already created.
 
         :param address: Address of I2C interface, eg. 0x20.
+        :param interrupt_port: Optional raspberry Port (from PiInterface)
+            wired to INTA or INTB of the chip. When given, port value
+            changes are detected with the chip interrupts instead of
+            polling the chip every 10ms.
         """
         super(MCP23017, self).__init__(16)
         self._address = address
-
-        # _MCP23017ListenerThread
-        self._read_events_thread = None
+        self._interrupt_port = interrupt_port
+
+        # None in no hardware mode.
+        self._bus = get_bus()
+        # Single register writes, see _write_register.
+        self._bus_write = (
+            self._bus.write_byte_data if self._bus is not None else None)
+
+        # Shadow of the device registers, indexed by register address
+        # (0x00 - 0x15, IOCON.BANK = 0 addressing). Written registers are
+        # computed from it instead of reading all sibling ports first.
+        # The device is set to match it in _initialize_ports.
+        self._registers = bytearray(0x16)
+
+        # (read time, GPIOA value, GPIOB value) of the last read from device,
+        # see _read_gpio_block.
+        self._gpio_cache = None
+
+        # Number of nested batch() blocks and registers changed within them,
+        # to be written when the outermost block ends.
+        self._batch_depth = 0
+        self._dirty_registers = set()
+
+        # _MCPPortListener by port number, checked by the listener thread.
+        self._port_listeners = {}
+        # Increased on every add_event, and (version, GPIOA, GPIOB) at the
+        # last check after which no port was pending, see
+        # _MCP23017ListenerThread._listeners_to_check().
+        self._listeners_version = 0
+        self._checked_values = None
 
         # Determines if pull up rezistor should be set for inputs.
         # If False nothing will be set, so by default input will be
@@ -103,7 +212,7 @@ class MCP23017(InOutInterface):
         self.use_pullup_rezistor = True
 
         for number in range(1, 17):
-            self._ports[number] = Port(self, number)
+            self._ports[number - 1] = Port(self, number)
 
         _REGISTRY.append(self)
         self._initialize_ports()
@@ -111,136 +220,237 @@ class MCP23017(InOutInterface):
     def __str__(self):
         return 'MCP23017 on address: {}'.format(hex(self._address))
 
-    def __del__(self):
-        self.clear_all_read_events()
+    def __enter__(self):
+        return self
 
-    def _get_events_thread(self):
-        """Returns thread that is listening for port value changes.
-        
-        This method initializes the thread if it not exists and should be 
-        always used for getting the listener.
-        
-        :returns _MCP23017ListenerThread
-        """
-        if not self._read_events_thread:
-            self._read_events_thread = _MCP23017ListenerThread(self)
-            self._read_events_thread.start()
-        return self._read_events_thread
+    def __exit__(self, *exc_info):
+        self.close()
 
-    def _get_part(self, port_number):
-        return self._PART_A if port_number <= 8 else self._PART_B
+    def close(self):
+        """Stops listening on ports and forgets the interface.
 
-    def _get_write_register(self, port_number):
-        """Returns write register for given port.
+        Interfaces are kept by the module (and by the listener thread while
+        listening) until closed. cleanup() stops listening on all of them. The
+        interface should not be used afterwards. It can be also done by
+        using the interface as a context manager:
 
-        There is different register for GPA and GPB.
+        > with MCP23017(0x20) as mcp:
+        >     mcp.set_high(1)
         """
-        part = self._get_part(port_number)
-        if part == self._PART_A:
-            return 0x14
-        elif part == self._PART_B:
-            return 0x15
-
-    def _get_read_register(self, port_number):
-        """Returns write register for given port.
-
-        There is different register for GPA and GPB.
+        self.clear_all_read_events()
+        if self in _REGISTRY:
+            _REGISTRY.remove(self)
+
+    def _start_interrupt_detection(self):
+        """Starts listening on the interrupt port, if there is one."""
+        if self._interrupt_port is None or Settings.IS_NO_HARDWARE_MODE:
+            return
+        self._interrupt_port.set_as_input()
+        gpio = get_gpio()
+        # No bouncetime here. Interrupt stays active until INTCAP is read,
+        # so a falling edge dropped by RPi.GPIO would block it forever.
+        # Debouncing is done by the listener thread.
+        gpio.add_event_detect(
+            self._interrupt_port.number,
+            gpio.FALLING,
+            callback=self._on_interrupt)
+
+    def _stop_interrupt_detection(self):
+        if self._interrupt_port is None or Settings.IS_NO_HARDWARE_MODE:
+            return
+        get_gpio().remove_event_detect(self._interrupt_port.number)
+        self._write_registers(0x04, (0x00, 0x00))
+
+    def _on_interrupt(self, channel):
+        """Called by RPi.GPIO when the chip signals a port value change.
+
+        It only wakes up the listener thread, which releases the interrupt
+        (see _release_interrupt) and checks the ports. So the bus is not
+        used from RPi.GPIO thread.
         """
-        part = self._get_part(port_number)
-        if part == self._PART_A:
-            return 0x12
-        elif part == self._PART_B:
-            return 0x13
+        thread = _LISTENER_THREAD
+        if thread:
+            thread.wake(self)
 
-    def _get_setas_register(self, port_number):
-        """Returns <setas> register for given port.
+    def _release_interrupt(self):
+        """Reads INTFA, INTFB, INTCAPA and INTCAPB at once.
 
-        Setas register is the one under which port can be defined as input
-        or output. There is different register for GPA and GPB.
+        It releases the interrupt line. Values read afterwards are the
+        current ones, not cached from before the interrupt.
         """
-        part = self._get_part(port_number)
-        if part == self._PART_A:
-            return 0x00
-        elif part == self._PART_B:
-            return 0x01
-
-    def _get_pullup_register(self, port_number):
-        """Returns register for setting pullup rezistor for inputs."""
-        part = self._get_part(port_number)
-        if part == self._PART_A:
-            return 0x0C
-        elif part == self._PART_B:
-            return 0x0D
-
-
-    def _get_binary_string_for_value(
-            self,
-            port_number,
-            value,
-            siblings_value_getter):
-        """Return binary string for GP ports part.
+        self._bus.read_i2c_block_data(self._address, 0x0E, 4)
+        self._gpio_cache = None
+
+    def _initialize_ports(self):
+        """Sets all ports as outputs with LOW value.
+
+        Instead of initializing ports one by one, the whole registers image
+        (0x00 - 0x15) is written in a single bus transaction, using the
+        registers address auto increment. Apart from IOCON all registers are
+        0: ports are outputs with LOW value, no pull ups, no interrupts.
+
+        IOCON is 0, which makes sure the registers addressing is the one
+        this class uses (BANK = 0) and that sequential operation is enabled
+        (SEQOP = 0), so GPIOA and GPIOB can be read at once. With interrupt
+        port given, INTA and INTB are mirrored (MIRROR = 1), so any of them
+        can be wired, and ports are compared against their previous values
+        (INTCON = 0).
+        """
+        iocon = 0x00 if self._interrupt_port is None else 0x40
+        image = bytearray(0x16)
+        image[0x0A] = iocon
+        image[0x0B] = iocon
+        self._write_registers(0x00, image)
+        for number in range(1, 17):
+            self._register_as_output(number)
 
-        It takes given value for given port, reads all other ports on given
-        GP ports part (either GPA or GPB) and returns binary string ready
-        to be written to the BUS.
+    def _read_gpio_block(self):
+        """Returns (GPIOA, GPIOB) register values.
 
-        siblings_value_getter is a tricky part, because this argument should
-        contain lambda function that should take Port object as argument
-        and return proper value for the given port (either self._HIGH or
-        self._LOW).
+        Both are read in a single bus transaction. Values read less than
+        Settings.MCP_READ_CACHE_TTL ms ago are returned without reading again.
+        """
+        now = _monotonic()
+        cache = self._gpio_cache
+        if (cache is not None and
+                now - cache[0] < Settings.MCP_READ_CACHE_TTL / 1000.0):
+            return cache[1], cache[2]
+        gpio_a, gpio_b = self._bus.read_i2c_block_data(self._address, 0x12, 2)
+        self._gpio_cache = (now, gpio_a, gpio_b)
+        return gpio_a, gpio_b
+
+    def _set_value(self, port_number, register, value):
+        """Sets bit of given port in register to value.
+
+        The new register value is computed from the registers shadow, so
+        no read from the device is needed, then written to the device and
+        to the shadow.
+        """
+        mask = self._BIT_MASKS[port_number - 1]
+        if value == HIGH:
+            register_value = self._registers[register] | mask
+        else:
+            register_value = self._registers[register] & ~mask
+        self._write_register(register, register_value)
 
-        :param port_number: port number
-        :param value: either self._HIGH or self._LOW
-        :param siblings_value_getter: lambda function
-        :return: string with binary representation of new value
+    def _write_register(self, register, register_value):
+        """Writes whole register value to the device and to the shadow.
 
+        Nothing is written when the shadow already has this value, eg. when
+        setting high a port that is already high.
         """
-        part = self._get_part(port_number)
-        start_port_number = 1
-        if part == self._PART_B:
-            start_port_number = 9
-
-        binary_value = []
-        for number in range(start_port_number, start_port_number + 8):
-            if number == port_number:
-                binary_value.append('1' if value == self.HIGH else '0')
-            else:
-                binary_value.append(
-                    '1' if siblings_value_getter(
-                        self._ports[number]) == self.HIGH
-                    else '0')
+        if self._registers[register] == register_value:
+            return
+        self._registers[register] = register_value
+        self._gpio_cache = None
+        # Arguments formatting costs more than the write itself, so it's
+        # done only when the message would be logged.
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug(
+                'Writing to interface %s on register %s value %s',
+                str(self),
+                hex(register),
+                format(register_value, '#010b')
+            )
 
-        return '0b%s' % ''.join(reversed(binary_value))
+        if self._batch_depth:
+            self._dirty_registers.add(register)
+        elif Settings.IS_NO_HARDWARE_MODE:
+            _log.warning('No hardware mode, no write done.')
+        else:
+            self._bus_write(self._address, register, register_value)
 
-    def _set_value(
-            self,
-            port_number,
-            register,
-            value,
-            siblings_value_getter):
-        # TODO: siblings_value_getter is weak solution. It reads all ports which cause
-        # the lag. The result is that if the second port is blinking it will never
-        # get the right thing done. Change it to read all siblings at once
+    @contextlib.contextmanager
+    def batch(self):
+        """Defers writes to the device until the end of with block.
 
-        binary_str_to_write = self._get_binary_string_for_value(
-            port_number,
-            value,
-            siblings_value_getter)
-        logging.debug(
-            'Writing to interface %s on register %s value %s',
-            str(self),
-            hex(register),
-            binary_str_to_write
-        )
+        Port changes done within the block only update the registers shadow.
+        When the block ends, each changed register is written once, so
+        eg. setting all 8 GPA ports high is a single bus write.
 
-        if Settings.IS_NO_HARDWARE_MODE:
-            logging.warning('No hardware mode, no write done.')
+        > with mcp.batch():
+        >     for number in range(1, 9):
+        >         mcp.set_high(number)
+
+        Blocks can be nested, writes are done at the end of outermost one.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self._write_dirty_registers()
+
+    def _write_registers(self, register, values):
+        """Writes values to consecutive registers, starting at given one.
+
+        It is a single bus transaction thanks to the registers address auto
+        increment (SEQOP = 0). The registers shadow is updated too.
+        """
+        values = bytearray(values)
+        self._registers[register:register + len(values)] = values
+        self._gpio_cache = None
+        if self._batch_depth:
+            self._dirty_registers.update(
+                range(register, register + len(values)))
+        elif Settings.IS_NO_HARDWARE_MODE:
+            _log.warning('No hardware mode, no write done.')
         else:
-            get_bus().write_byte_data(
-                self._address,
-                register,
-                int(binary_str_to_write, 2)
-            )
+            self._bus.write_i2c_block_data(
+                self._address, register, list(values))
+
+    def _write_dirty_registers(self):
+        dirty_registers = self._dirty_registers
+        if not dirty_registers:
+            return
+        # Consecutive registers (eg. OLATA and OLATB) are written at once.
+        runs = []
+        for register in sorted(dirty_registers):
+            if runs and runs[-1][-1] == register - 1:
+                runs[-1].append(register)
+            else:
+                runs.append([register])
+        dirty_registers.clear()
+        if Settings.IS_NO_HARDWARE_MODE:
+            _log.warning('No hardware mode, no write done.')
+            return
+        # Highest registers first, so OLAT is written before IODIR and
+        # ports set as outputs start with their new values.
+        registers = self._registers
+        for run in reversed(runs):
+            if len(run) == 1:
+                self._bus.write_byte_data(
+                    self._address, run[0], registers[run[0]])
+            else:
+                self._bus.write_i2c_block_data(
+                    self._address,
+                    run[0],
+                    list(registers[run[0]:run[-1] + 1]))
+
+    def configure_all(self, iodir_a, iodir_b):
+        """Sets all ports as inputs or outputs at once.
+
+        Ports with bits set in iodir_a (GPA) or iodir_b (GPB) become inputs,
+        the others outputs, bit 0 being the first port of the part.
+        Directions of all 16 ports are a single bus write (plus one for pull
+        up rezistors of inputs, if use_pullup_rezistor is set).
+        """
+        iodir_a &= 0xFF
+        iodir_b &= 0xFF
+        registers = self._registers
+        if self.use_pullup_rezistor:
+            self._write_registers(
+                0x0C, (registers[0x0C] | iodir_a, registers[0x0D] | iodir_b))
+        self._write_registers(0x00, (iodir_a, iodir_b))
+        inputs = iodir_a | iodir_b << 8
+        for number in range(1, 17):
+            if inputs >> (number - 1) & 1:
+                self._register_as_input(number)
+            else:
+                self._register_as_output(number)
+                self.clear_read_events(number)
+        return self
 
     @property
     def address(self):
@@ -253,118 +463,224 @@ class MCP23017(InOutInterface):
         It can be used both for input and output ports.
 
         The port value is read in the same manner it is written to.
-        The whole 8-bit registry is read, converted to binary string,
-        and value for given port is read from it.
+        Both GPIOA and GPIOB 8-bit registries are read (see
+        _read_gpio_block) and value for given port is the bit of it.
         """
-        self._validate_port_number(port_number)
-        value = self._check_no_hardware_port_value(port_number)
-        if value is not None:
-            return value
-        else:
-            value = get_bus().read_byte_data(
-                self._address,
-                self._get_read_register(port_number)
-            )
-            # Decode. Incoming binary value represent the whole 8 bit register.
-            # So format the number to be binary representation without
-            # '0b' prefix, revert it and get the port value.
-
-            # logging.debug(
-            #     'Reading value for port %s -> %s',
-            #     self.get_port(port_number),
-            #     format(value, '#010b'))
-            index = (port_number - 1) % 8
-            value = format(value, '08b')[::-1][index]
-            if value == '0':
-                return self.LOW
-            elif value == '1':
-                return self.HIGH
+        if __debug__:
+            self._validate_port_number(port_number)
+        if Settings.IS_NO_HARDWARE_MODE:
+            return self._get_no_hardware_port_value(port_number)
+        value = self._read_gpio_block()[0 if port_number <= 8 else 1]
+        # _log.debug(
+        #     'Reading value for port %s -> %s',
+        #     self.get_port(port_number),
+        #     format(value, '#010b'))
+        return HIGH if value & self._BIT_MASKS[port_number - 1] else LOW
+
+    def read_all(self):
+        """Returns (GPA, GPB) values of all ports as two 8-bit ints.
+
+        Bit 0 is the first port of the part. Both registers are read from the
+        device in a single bus transaction, refreshing the values reused by
+        following reads (see Settings.MCP_READ_CACHE_TTL).
+        """
+        if Settings.IS_NO_HARDWARE_MODE:
+            values = self.get_values()
+            return (
+                sum(value << bit for bit, value in enumerate(values[:8])),
+                sum(value << bit for bit, value in enumerate(values[8:])))
+        self._gpio_cache = None
+        return self._read_gpio_block()
+
+    def get_values(self, port_numbers=None):
+        """Returns list of values read from given ports.
+
+        GPA and GPB registers are read once, in a single bus transaction,
+        no matter how many ports are requested.
+        """
+        if port_numbers is None:
+            port_numbers = range(1, 17)
+        port_numbers = list(port_numbers)
+        if __debug__:
+            for port_number in port_numbers:
+                self._validate_port_number(port_number)
+        if Settings.IS_NO_HARDWARE_MODE:
+            return [self._get_no_hardware_port_value(port_number)
+                    for port_number in port_numbers]
+
+        gpio_a, gpio_b = self._read_gpio_block()
+        values = []
+        for port_number in port_numbers:
+            register_value = gpio_a if port_number <= 8 else gpio_b
+            if register_value & self._BIT_MASKS[port_number - 1]:
+                values.append(HIGH)
             else:
-                # This actually should never happen.
-                raise Error(
-                    'Could not read value for port %s',
-                    self.get_port(port_number))
+                values.append(LOW)
+        return values
 
     def set_high(self, port_number):
-        self._validate_port_number(port_number)
-        self._validate_write_port_number(port_number)
+        if __debug__:
+            self._validate_port_number(port_number)
+            self._validate_write_port_number(port_number)
         self._set_value(
             port_number,
-            self._get_write_register(port_number),
-            self.HIGH,
-            lambda x: self.HIGH if x.is_high else self.LOW
+            self._WRITE_REGISTERS[port_number - 1],
+            HIGH
         )
         return self
 
     def set_low(self, port_number):
-        self._validate_port_number(port_number)
-        self._validate_write_port_number(port_number)
+        if __debug__:
+            self._validate_port_number(port_number)
+            self._validate_write_port_number(port_number)
         self._set_value(
             port_number,
-            self._get_write_register(port_number),
-            self.LOW,
-            lambda x: self.HIGH if x.is_high else self.LOW
+            self._WRITE_REGISTERS[port_number - 1],
+            LOW
         )
         return self
 
+    def toggle(self, port_number):
+        """Inverts value of output port with one bus write and no reads.
+
+        The new value is the inverted bit of the registers shadow.
+        """
+        if __debug__:
+            self._validate_port_number(port_number)
+            self._validate_write_port_number(port_number)
+        register = self._WRITE_REGISTERS[port_number - 1]
+        self._write_register(
+            register,
+            self._registers[register] ^ self._BIT_MASKS[port_number - 1])
+        return self
+
+    def set_ports_high(self, port_numbers):
+        """Sets given ports HIGH with at most one bus write."""
+        with self.batch():
+            for port_number in port_numbers:
+                self.set_high(port_number)
+        return self
+
+    def set_ports_low(self, port_numbers):
+        """Sets given ports LOW with at most one bus write."""
+        with self.batch():
+            for port_number in port_numbers:
+                self.set_low(port_number)
+        return self
+
+    def set_bank(self, bank, value):
+        """Sets values of all 8 ports of GPA ('A') or GPB ('B') at once.
+
+        Bit 0 of value is the first port of the part. It is a single write
+        with no ports validation, bits of input ports have no effect on them.
+        """
+        self._write_register(self._BANK_WRITE_REGISTERS[bank], value & 0xFF)
+        return self
+
     def set_as_input(self, port_number):
-        self._validate_port_number(port_number)
+        if __debug__:
+            self._validate_port_number(port_number)
         self._set_value(
             port_number,
-            self._get_setas_register(port_number),
-            self.HIGH,
-            lambda x: self.HIGH if x.is_input else self.LOW
+            self._SETAS_REGISTERS[port_number - 1],
+            HIGH
         )
         if self.use_pullup_rezistor:
             self._set_value(
                 port_number,
-                self._get_pullup_register(port_number),
-                self.HIGH,
-                lambda x: self.HIGH if x.is_input else self.LOW
+                self._PULLUP_REGISTERS[port_number - 1],
+                HIGH
             )
-        self._in_out_registry[port_number] = self._INPUT
+        self._register_as_input(port_number)
         return self
 
     def set_as_output(self, port_number):
-        self._validate_port_number(port_number)
+        if __debug__:
+            self._validate_port_number(port_number)
         self._set_value(
             port_number,
-            self._get_setas_register(port_number),
-            self.LOW,
-            lambda x: self.HIGH if x.is_input else self.LOW
+            self._SETAS_REGISTERS[port_number - 1],
+            LOW
         )
 
-        self._in_out_registry[port_number] = self._OUTPUT
+        self._register_as_output(port_number)
         self.clear_read_events(port_number)
         return self
 
+    def set_output_high(self, port_number):
+        """Sets port as output with HIGH value."""
+        return self._set_as_output_with_value(port_number, HIGH)
+
+    def set_output_low(self, port_number):
+        """Sets port as output with LOW value."""
+        return self._set_as_output_with_value(port_number, LOW)
+
+    def _set_as_output_with_value(self, port_number, value):
+        # OLAT is written before IODIR, so the port drives the requested value
+        # as soon as it becomes an output, with no glitch of the old one.
+        # Both are written from local state, no reads involved.
+        if __debug__:
+            self._validate_port_number(port_number)
+        self._set_value(
+            port_number,
+            self._WRITE_REGISTERS[port_number - 1],
+            value
+        )
+        return self.set_as_output(port_number)
+
     def add_event(
             self,
             port_number,
             on_rising_callback=None,
             on_falling_callback=None):
         self._validate_listen_port_number(port_number)
-        listener = self._get_events_thread()
+        port_listener = self._port_listeners.get(port_number)
+        if port_listener is None:
+            # Created first, as it validates the port number. So an invalid
+            # one does not leave the interrupt detection started with no
+            # listeners.
+            port_listener = _MCPPortListener(self.get_port(port_number))
+            if not self._port_listeners:
+                self._start_interrupt_detection()
+            self._port_listeners[port_number] = port_listener
+            if self._interrupt_port is not None:
+                self._set_value(
+                    port_number,
+                    self._INTERRUPT_REGISTERS[port_number - 1],
+                    HIGH)
+            # Also makes the thread read the port value to compare to now.
+            _listen(self)
         if on_rising_callback:
-            listener.on_rising(self.get_port(port_number), on_rising_callback)
+            port_listener.add_rising_callback(on_rising_callback)
         if on_falling_callback:
-            listener.on_falling(self.get_port(port_number), on_falling_callback)
+            port_listener.add_falling_callback(on_falling_callback)
+        # Makes the thread check all listeners, the new one included.
+        self._listeners_version += 1
 
     def clear_read_events(self, port_number):
-        listener = self._read_events_thread
-        if listener:
-            listener.clear_events(self.get_port(port_number))
-            if not listener.has_any_events():
-                listener.stop()
-                self._read_events_thread = None
+        # Drop the listener entirely, so the port is not checked anymore.
+        port_listener = self._port_listeners.pop(port_number, None)
+        if port_listener is None:
+            return
+        port_listener.clear_callbacks()
+        if not self._port_listeners:
+            self._stop_interrupt_detection()
+            _stop_listening(self)
+        elif self._interrupt_port is not None:
+            self._set_value(
+                port_number,
+                self._INTERRUPT_REGISTERS[port_number - 1],
+                LOW)
 
     def clear_all_read_events(self):
-        """Completely destroys read event thread if it exists."""
-        if self._read_events_thread:
-            logging.debug(
-                'Gently stopping events thread on interface: %s', self)
-            self._read_events_thread.stop()
-            self._read_events_thread = None
+        """Stops listening on all ports of the interface."""
+        if self._port_listeners:
+            _log.debug('Stopping listening on interface: %s', self)
+            for port_listener in self._port_listeners.values():
+                port_listener.clear_callbacks()
+            self._port_listeners.clear()
+            self._stop_interrupt_detection()
+            _stop_listening(self)
 
     def is_high_gpa(self, port_number):
         return self.is_high(port_number)
@@ -410,107 +726,343 @@ class MCP23017(InOutInterface):
 
 
 class _MCPPortListener(PortListener):
+    """Listener on MCP23017 port.
+
+    Port value can be given as already read GPIOA and GPIOB register values,
+    so a single read can be shared by all listeners of the interface. When
+    they are None, the port is read (eg. in no hardware mode).
+    """
+
+    __slots__ = (
+        '_is_b',
+        '_mask',
+        'cooldown_until',
+        '_pending_value',
+        '_pending_since',
+    )
+
     def __init__(self, port):
         super(_MCPPortListener, self).__init__(port)
-        self.last_read_value = port.value
-
-    def get_callbacks_to_trigger(self):
+        # Used with Settings.READ_SWITCH_IMMEDIATE, time until which the port
+        # is not checked after triggering callbacks.
+        self.cooldown_until = 0
+        # Otherwise value different than last_read_value is pending until it
+        # lasts for debounce time: the value and time it was first read.
+        self._pending_value = None
+        self._pending_since = 0
+        self._is_b = port.number > 8
+        self._mask = 1 << ((port.number - 1) & 7)
+
+    def _get_value(self, gpio_a, gpio_b):
+        if gpio_a is None:
+            return self.port.value
+        return HIGH if (gpio_b if self._is_b else gpio_a) & self._mask else LOW
+
+    def get_callbacks_to_trigger(self, gpio_a=None, gpio_b=None):
         if not self._rising_callbacks and not self._falling_callbacks:
             return []
-        to_trigger = []
-        new_value = self.port.value
-        if new_value != self.last_read_value:
-            if (new_value == InOutInterface.HIGH
-                and self.last_read_value == InOutInterface.LOW):
-                to_trigger.extend(self._rising_callbacks)
-            if (new_value == InOutInterface.LOW
-                and self.last_read_value == InOutInterface.HIGH):
-                to_trigger.extend(self._falling_callbacks)
-
+        new_value = self._get_value(gpio_a, gpio_b)
+        if self.last_read_value is None:
+            # First read, just the value to compare to later.
             self.last_read_value = new_value
-        return to_trigger
+            return []
+        if new_value == self.last_read_value:
+            return []
+        self.last_read_value = new_value
+        return self._callbacks_by_value[new_value]
 
-    def has_changed(self):
-        """Return true if port value changed since last read."""
-        new_value = self.port.value
-        return new_value != self.last_read_value
+    def get_debounced_callbacks_to_trigger(
+            self, gpio_a, gpio_b, now, debounce):
+        """Same as get_callbacks_to_trigger, for changes lasting debounce.
+
+        New value must be read every time during debounce (s) to become
+        last_read_value, any other value read meanwhile starts from scratch.
+
+        :returns (callbacks to trigger, time (s) left until pending value
+            lasts long enough or None when nothing is pending)
+        """
+        if not self._rising_callbacks and not self._falling_callbacks:
+            return [], None
+        new_value = self._get_value(gpio_a, gpio_b)
+        if self.last_read_value is None:
+            # First read, just the value to compare to later.
+            self.last_read_value = new_value
+        if new_value == self.last_read_value:
+            self._pending_value = None
+            return [], None
+        if new_value != self._pending_value:
+            self._pending_value = new_value
+            self._pending_since = now
+        remaining = self._pending_since + debounce - now
+        if remaining > 0:
+            return [], remaining
+        self._pending_value = None
+        self.last_read_value = new_value
+        return self._callbacks_by_value[new_value], None
 
 
 class _MCP23017ListenerThread(threading.Thread):
     """Thread used for listening on MCP23017 ports.
 
     As reading on this i2c extension must be somehow made, separate thread
-    should be created to monitor the ports.
+    should be created to monitor the ports. There is one such thread for
+    all MCP23017 interfaces, see _listen(). For each interface the ports are
+    read once per check, and all of them are checked in the same loop.
+
+    Lifecycle: started by the first _listen(), stopped by _stop_listening()
+    of the last interface, and a brand new one is started by the next
+    _listen(). Exceptions raised by callbacks are logged and do not end the
+    thread; if it dies anyway, the next _listen() replaces it.
 
     It allows to register multiple callbacks for port that will be triggered
     when the value on port changes from low to high or vice versa.
 
+    Interfaces with interrupt port are not polled, they are checked when
+    woken up by the interrupt (and anyway every _INTERRUPT_FALLBACK_POLL
+    seconds). Others are polled every _POLL_INTERVAL seconds (10ms), and
+    anyway when a pending port change should be settled.
+
     Each callback will be triggered with two arguments:
     1. port instance
     2. value read from port that triggered the callback (this should be equal
     to the one read from port afterwards, but who knows, lags might happen).
     """
 
-    def __init__(self, interface):
+    _INTERRUPT_FALLBACK_POLL = 1
+    _POLL_INTERVAL = 0.01
+
+    def __init__(self):
         super(_MCP23017ListenerThread, self).__init__(
-            name="Listener on %s" % interface)
-        self._interface = interface
-        self._listeners_by_port_number = {}
-        self._stop = False
+            name="Listener on MCP23017 interfaces")
+        # Interfaces with any listened port. Kept until they stop listening,
+        # see MCP23017.close() and cleanup().
+        self._interfaces = set()
+        # Interfaces woken up since last check. Guarded by the lock, as wake()
+        # is called from RPi.GPIO thread while run() swaps the set.
+        self._woken_interfaces = set()
+        self._woken_lock = threading.Lock()
+        # Not named _stop, which is a method of threading.Thread in python 3.
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
         # Make it a deamon so whole program should not wait for it to terminate.
-        self.setDaemon(True)
+        self.daemon = True
 
-    def on_rising(self, port, callback):
-        self._listeners_by_port_number.setdefault(
-            port.number, _MCPPortListener(port)
-        ).add_rising_callback(callback)
+    def add_interface(self, interface):
+        self._interfaces.add(interface)
+        self.wake(interface)
 
-    def on_falling(self, port, callback):
-        self._listeners_by_port_number.setdefault(
-            port.number, _MCPPortListener(port)
-        ).add_falling_callback(callback)
-
-    def clear_events(self, port):
-        if port.number in self._listeners_by_port_number:
-            self._listeners_by_port_number[port.number].clear_callbacks()
+    def remove_interface(self, interface):
+        self._interfaces.discard(interface)
 
     def has_any_events(self):
-        """Returns true if there are any events defined for any port.
+        """Returns true if there are any interfaces to check.
         
         If returns false it might be a good indication that this thread
         is no longer needed.
         """
-        return bool(self._listeners_by_port_number)
+        return bool(self._interfaces)
+
+    def _read_ports(self, interface):
+        """Returns (GPIOA, GPIOB) values, (None, None) in no hardware mode.
+
+        Returns None when reading fails. The thread is shared by all
+        interfaces, so a bus error on one of them is only logged and the
+        interface is skipped until the next check.
+        """
+        if Settings.IS_NO_HARDWARE_MODE:
+            return None, None
+        try:
+            return interface._read_gpio_block()
+        except Exception:
+            _log.exception('Reading ports failed for: %s', interface)
+            return None
+
+    def wake(self, interface):
+        """Makes the thread check the interface ports now."""
+        with self._woken_lock:
+            self._woken_interfaces.add(interface)
+        self._wake_event.set()
 
     def stop(self):
-        self._stop = True
+        """Stops the thread and waits (up to 1s) until it finishes.
 
-    def run(self):
-        logging.debug('Starting event thread on %s', self._interface)
-        while not self._stop:
-            trigger_data_by_port_number = {}
-            for port_number, port_listener in (
-                    self._listeners_by_port_number.iteritems()):
-                callbacks = port_listener.get_callbacks_to_trigger()
+        When called from the thread itself (eg. from a callback clearing
+        events) it does not wait.
+        """
+        self._stop_event.set()
+        self._wake_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(1)
+
+    def _trigger(self, port_listener):
+        value = port_listener.last_read_value
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug(
+                'Event detected on interface (%s) on port (%s). Type: %s.',
+                port_listener.port.interface,
+                port_listener.port.number,
+                'RISING' if value == HIGH else 'FALLING')
+        # The thread is shared by all interfaces, a failing callback must not
+        # stop listening on any of them.
+        try:
+            dispatch_callbacks(
+                port_listener._triggers_by_value[value],
+                port_listener.port,
+                value)
+        except Exception:
+            _log.exception(
+                'Event callback failed for: %s', port_listener.port)
+
+    def _listeners_to_check(self, interface, gpio_a, gpio_b):
+        """Returns listeners of the interface ports to check now.
+
+        If no port was pending (debounced or cooling down) at the last check,
+        only listeners of ports with bits changed since then are returned,
+        found by iterating over the set bits of XORed values. Otherwise, or
+        if listeners were added meanwhile, all of them.
+        """
+        port_listeners = interface._port_listeners
+        checked_values = interface._checked_values
+        if (gpio_a is None or checked_values is None or
+                checked_values[0] != interface._listeners_version):
+            # Copy, listeners may be added from other threads meanwhile.
+            return list(port_listeners.values())
+        changed = (
+            (gpio_a ^ checked_values[1]) | (gpio_b ^ checked_values[2]) << 8)
+        listeners = []
+        while changed:
+            bit = changed & -changed
+            # Bit 0 is port 1.
+            port_listener = port_listeners.get(bit.bit_length())
+            if port_listener is not None:
+                listeners.append(port_listener)
+            changed ^= bit
+        return listeners
+
+    def _trigger_debounced(self, interfaces):
+        """Triggers callbacks for changes that persist for debounce time.
+
+        The new port value must be read on every check for
+        READ_SWITCH_DEBOUNCE ms, so a bounce starts the count again. Nothing
+        waits meanwhile, other ports and interfaces are checked as usual.
+
+        :returns time (s) until the nearest pending change lasts long enough,
+            None if there is no pending change.
+        """
+        now = _monotonic()
+        # Float division, with integer one python 2 debounce would be 0.
+        debounce = Settings.READ_SWITCH_DEBOUNCE / 1000.0
+        timeout = None
+        for interface in interfaces:
+            # Taken before the listeners, so any added later are checked.
+            version = interface._listeners_version
+            values = self._read_ports(interface)
+            if values is None:
+                continue
+            gpio_a, gpio_b = values
+            settled = True
+            for port_listener in self._listeners_to_check(
+                    interface, gpio_a, gpio_b):
+                callbacks, remaining = (
+                    port_listener.get_debounced_callbacks_to_trigger(
+                        gpio_a, gpio_b, now, debounce))
                 if callbacks:
-                    trigger_data_by_port_number[port_number] = (
-                        callbacks, port_listener)
-
-            if trigger_data_by_port_number:
-                time.sleep(Settings.READ_SWITCH_DEBOUNCE / 1000)
-                for port_number, trigger_data in (
-                        trigger_data_by_port_number.iteritems()):
-                    if not self._listeners_by_port_number[port_number].has_changed():
-                        logging.debug(
-                            'Event detected on interface (%s) on port (%s). '
-                            'Type: %s.',
-                            self._interface,
-                            port_number,
-                            'RISING' if trigger_data[1].last_read_value == MCP23017.HIGH else 'FALLING')
-                        for callback in trigger_data[0]:
-                            callback(
-                                trigger_data[1].port,
-                                trigger_data[1].last_read_value
-                            )
-
-            time.sleep(0.01)
+                    self._trigger(port_listener)
+                elif remaining is not None:
+                    settled = False
+                    if timeout is None or remaining < timeout:
+                        timeout = remaining
+            interface._checked_values = (
+                (version, gpio_a, gpio_b) if settled else None)
+        return timeout
+
+    def _trigger_immediately(self, interfaces):
+        """Triggers callbacks on the first detected change of port value.
+
+        The port is then not checked for READ_SWITCH_DEBOUNCE ms (cool down),
+        so bounces are ignored. Value found after the cool down is compared
+        with the triggered one, so a change meanwhile is not lost.
+
+        :returns time (s) to the end of nearest cool down, None if no port
+            is cooling down.
+        """
+        now = _monotonic()
+        cooldown = Settings.READ_SWITCH_DEBOUNCE / 1000.0
+        timeout = None
+        for interface in interfaces:
+            version = interface._listeners_version
+            values = self._read_ports(interface)
+            if values is None:
+                continue
+            gpio_a, gpio_b = values
+            settled = True
+            for port_listener in self._listeners_to_check(
+                    interface, gpio_a, gpio_b):
+                remaining = port_listener.cooldown_until - now
+                if remaining <= 0 and port_listener.get_callbacks_to_trigger(
+                        gpio_a, gpio_b):
+                    self._trigger(port_listener)
+                    port_listener.cooldown_until = now + cooldown
+                    remaining = cooldown
+                if remaining > 0:
+                    settled = False
+                    if timeout is None or remaining < timeout:
+                        timeout = remaining
+            interface._checked_values = (
+                (version, gpio_a, gpio_b) if settled else None)
+        return timeout
+
+    def run(self):
+        _log.debug('Starting event thread: %s', self.name)
+        stop_event = self._stop_event
+        wake_event = self._wake_event
+        # Time of next check of interrupt driven interfaces not woken up.
+        next_full_check = 0
+        while not stop_event.is_set():
+            # Cleared before the swap, so a wake() after it sets the event
+            # again and its interface is checked on the next loop.
+            wake_event.clear()
+            with self._woken_lock:
+                woken_interfaces = self._woken_interfaces
+                self._woken_interfaces = set()
+            now = _monotonic()
+            full_check = now >= next_full_check
+            if full_check:
+                next_full_check = now + self._INTERRUPT_FALLBACK_POLL
+
+            all_interfaces = list(self._interfaces)
+            polling = False
+            interfaces = []
+            for interface in all_interfaces:
+                if interface._interrupt_port is None:
+                    polling = True
+                    interfaces.append(interface)
+                elif interface in woken_interfaces:
+                    if not Settings.IS_NO_HARDWARE_MODE:
+                        try:
+                            interface._release_interrupt()
+                        except Exception:
+                            # Skipped until the next full check, its ports
+                            # read releases the interrupt too.
+                            _log.exception(
+                                'Releasing interrupt failed for: %s',
+                                interface)
+                            continue
+                    interfaces.append(interface)
+                elif full_check:
+                    interfaces.append(interface)
+
+            if Settings.READ_SWITCH_IMMEDIATE:
+                timeout = self._trigger_immediately(interfaces)
+            else:
+                timeout = self._trigger_debounced(interfaces)
+            if timeout is not None:
+                # After cool down or debounce port must be checked even with
+                # no interrupt.
+                next_full_check = min(next_full_check, _monotonic() + timeout)
+            # Pending changes (debounce, cool down) are waited for exactly,
+            # so they are not handled up to a whole polling interval late.
+            wait = max(0, next_full_check - _monotonic())
+            if polling:
+                wait = min(wait, self._POLL_INTERVAL)
+            wake_event.wait(wait)
@@ -10,7 +10,9 @@ as any others implementing InOutInterface.
 
 import logging
 
+from base import HIGH
 from base import InOutInterface
+from base import LOW
 from base import get_gpio
 from base import Settings
 from base import PortListener
@@ -18,6 +20,9 @@ from exceptions import InvalidPortNumberError
 from port import Port
 
 
+_log = logging.getLogger(__name__)
+
+
 class PiInterface(InOutInterface):
     """Standard GPIO interface abstraction layer.
 
@@ -31,20 +36,47 @@ class PiInterface(InOutInterface):
 
     """
 
-    _GROUND = (6, 9, 14, 20, 25, 30, 34, 39)
-    _POWER_5V = (2, 4)
-    _POWER_3V3 = (1, 17)
-    _I2C = (3, 5, 27, 28)
-    _FORBIDDEN = _GROUND + _POWER_5V + _POWER_3V3 + _I2C
+    _GROUND = frozenset((6, 9, 14, 20, 25, 30, 34, 39))
+    _POWER_5V = frozenset((2, 4))
+    _POWER_3V3 = frozenset((1, 17))
+    _I2C = frozenset((3, 5, 27, 28))
+    _FORBIDDEN = _GROUND | _POWER_5V | _POWER_3V3 | _I2C
+
+    # What the forbidden port is reserved for, by port number.
+    _RESERVED_FOR = dict(
+        [(number, 'GROUND') for number in _GROUND] +
+        [(number, '3.3V POWER') for number in _POWER_3V3] +
+        [(number, '5V POWER') for number in _POWER_5V] +
+        [(number, 'I2c') for number in _I2C])
 
     PULL_UP = 'pull_up'
     PULL_DOWN = 'pull_down'
 
+    __slots__ = (
+        '_gpio',
+        '_gpio_write',
+        '_gpio_levels',
+        'pull_up_down_rezistor',
+        '_port_listeners',
+    )
+
     def __init__(self):
         super(PiInterface, self).__init__(40)
+
+        # Kept from creation time, see base.init(). None with no hardware.
+        self._gpio = get_gpio()
+        # What _gpio_output needs: GPIO.output and the RPi.GPIO levels
+        # matching HIGH / LOW.
+        if self._gpio is not None:
+            self._gpio_write = self._gpio.output
+            self._gpio_levels = {HIGH: self._gpio.HIGH, LOW: self._gpio.LOW}
+        else:
+            self._gpio_write = None
+            self._gpio_levels = None
+
         for number in range(1, 41):
             if number not in self._FORBIDDEN:
-                self._ports[number] = Port(self, number)
+                self._ports[number - 1] = Port(self, number)
 
         # Defines the pull up or pull down rezistor for inputs.
         # Possible values are:
@@ -62,28 +94,19 @@ class PiInterface(InOutInterface):
 
     def _validate_port_number(self, port_number):
         super(PiInterface, self)._validate_port_number(port_number)
-        if port_number in self._GROUND:
-            raise InvalidPortNumberError(
-                'This port number(%d) is reserved for GROUND.', port_number)
-        if port_number in self._POWER_3V3:
+        reserved_for = self._RESERVED_FOR.get(port_number)
+        if reserved_for is not None:
             raise InvalidPortNumberError(
-                'This port number(%d) is reserved for 3.3V POWER.', port_number)
-        if port_number in self._POWER_5V:
-            raise InvalidPortNumberError(
-                'This port number(%d) is reserved for 5V POWER.', port_number)
-        if port_number in self._I2C:
-            raise InvalidPortNumberError(
-                'This port number(%d) is reserved for I2c.', port_number)
-        if port_number in self._FORBIDDEN:
-            raise InvalidPortNumberError(
-                'This port number(%d) is forbidden to take.', port_number)
+                'This port number(%d) is reserved for %s.' % (
+                    port_number, reserved_for))
 
     def _gpio_setup(self, port_number, gpio_attr_name):
-        self._validate_port_number(port_number)
+        if __debug__:
+            self._validate_port_number(port_number)
         if Settings.IS_NO_HARDWARE_MODE:
-            logging.warning('No hardware mode, no value written')
+            _log.warning('No hardware mode, no value written')
         else:
-            gpio = get_gpio()
+            gpio = self._gpio
             if gpio_attr_name == 'IN':
                 # Special case for settings port as input.
                 # Pullup or pulldown rezistor should be set here.
@@ -100,50 +123,92 @@ class PiInterface(InOutInterface):
                 gpio.setup(port_number, getattr(gpio, gpio_attr_name))
 
     def _gpio_output(self, port_number, value):
-        self._validate_port_number(port_number)
+        # Port number is validated by callers.
         if Settings.IS_NO_HARDWARE_MODE:
-            logging.warning('No hardware mode, no value written')
+            _log.warning('No hardware mode, no value written')
         else:
-            gpio = get_gpio()
-            gpio.output(
-                port_number,
-                gpio.HIGH if value == self.HIGH else gpio.LOW
-            )
+            self._gpio_write(port_number, self._gpio_levels[value])
 
     def get_value(self, port_number):
-        self._validate_port_number(port_number)
-        value = self._check_no_hardware_port_value(port_number)
-        if value is not None:
-            return value
-        else:
-            gpio = get_gpio()
-            value = gpio.input(port_number)
-            # logging.debug(
-            #     'Read gpio port value (%s): %s',
-            #     self.get_port(port_number),
-            #     value)
-            return self.HIGH if value == gpio.HIGH else self.LOW
+        if __debug__:
+            self._validate_port_number(port_number)
+        if Settings.IS_NO_HARDWARE_MODE:
+            return self._get_no_hardware_port_value(port_number)
+        gpio = self._gpio
+        value = gpio.input(port_number)
+        # _log.debug(
+        #     'Read gpio port value (%s): %s',
+        #     self.get_port(port_number),
+        #     value)
+        return HIGH if value == gpio.HIGH else LOW
 
     def set_as_input(self, port_number):
         self._gpio_setup(port_number, 'IN')
-        self._in_out_registry[port_number] = self._INPUT
+        self._register_as_input(port_number)
         return self
 
     def set_as_output(self, port_number):
         self._gpio_setup(port_number, 'OUT')
-        self._in_out_registry[port_number] = self._OUTPUT
+        self._register_as_output(port_number)
+        return self
+
+    def set_output_high(self, port_number):
+        """Sets port as output with HIGH value, with one RPi.GPIO call."""
+        return self._set_as_output_with_value(port_number, HIGH)
+
+    def set_output_low(self, port_number):
+        """Sets port as output with LOW value, with one RPi.GPIO call."""
+        return self._set_as_output_with_value(port_number, LOW)
+
+    def _set_as_output_with_value(self, port_number, value):
+        if __debug__:
+            self._validate_port_number(port_number)
+        if Settings.IS_NO_HARDWARE_MODE:
+            _log.warning('No hardware mode, no value written')
+        else:
+            # The value is set by setup itself, before the port starts
+            # driving it.
+            gpio = self._gpio
+            gpio.setup(
+                port_number, gpio.OUT, initial=self._gpio_levels[value])
+        self._register_as_output(port_number)
         return self
 
     def set_high(self, port_number):
-        self._validate_port_number(port_number)
-        self._validate_write_port_number(port_number)
-        self._gpio_output(port_number, self.HIGH)
+        if __debug__:
+            self._validate_port_number(port_number)
+            self._validate_write_port_number(port_number)
+        self._gpio_output(port_number, HIGH)
         return self
 
     def set_low(self, port_number):
-        self._validate_port_number(port_number)
-        self._validate_write_port_number(port_number)
-        self._gpio_output(port_number, self.LOW)
+        if __debug__:
+            self._validate_port_number(port_number)
+            self._validate_write_port_number(port_number)
+        self._gpio_output(port_number, LOW)
+        return self
+
+    def set_ports_high(self, port_numbers):
+        """Sets given ports HIGH with one RPi.GPIO call."""
+        return self._set_ports_value(port_numbers, HIGH)
+
+    def set_ports_low(self, port_numbers):
+        """Sets given ports LOW with one RPi.GPIO call."""
+        return self._set_ports_value(port_numbers, LOW)
+
+    def _set_ports_value(self, port_numbers, value):
+        port_numbers = list(port_numbers)
+        if __debug__:
+            for port_number in port_numbers:
+                self._validate_port_number(port_number)
+                self._validate_write_port_number(port_number)
+        if not port_numbers:
+            return self
+        if Settings.IS_NO_HARDWARE_MODE:
+            _log.warning('No hardware mode, no value written')
+        else:
+            # GPIO.output accepts list of channels as well.
+            self._gpio_write(port_numbers, self._gpio_levels[value])
         return self
 
     def add_event(
@@ -158,12 +223,12 @@ class PiInterface(InOutInterface):
         that actually cause triggering the event.
         """
         if Settings.IS_NO_HARDWARE_MODE:
-            logging.warning('No hardware mode, adding read event failed.')
+            _log.warning('No hardware mode, adding read event failed.')
         else:
             port_listener = self._port_listeners.get(port_number)
             if not port_listener:
                 port_listener = _PiPortListener(self.get_port(port_number))
-                gpio = get_gpio()
+                gpio = self._gpio
                 gpio.add_event_detect(
                     port_number,
                     gpio.BOTH,
@@ -172,42 +237,37 @@ class PiInterface(InOutInterface):
                 self._port_listeners[port_number] = port_listener
 
             if on_rising_callback:
-                logging.debug(
+                _log.debug(
                     'Adding rising callback for interface (%s) on port %d',
                     self, port_number)
                 port_listener.add_rising_callback(on_rising_callback)
             if on_falling_callback:
-                logging.debug(
+                _log.debug(
                     'Adding falling callback for interface (%s) on port %d',
                     self, port_number)
                 port_listener.add_falling_callback(on_falling_callback)
 
     def clear_read_events(self, port_number):
         if not Settings.IS_NO_HARDWARE_MODE:
-            get_gpio().remove_event_detect(port_number)
+            self._gpio.remove_event_detect(port_number)
             if port_number in self._port_listeners:
                 del self._port_listeners[port_number]
 
 
 class _PiPortListener(PortListener):
+    __slots__ = ()
+
     def get_callbacks_to_trigger(self):
         if not self._rising_callbacks and not self._falling_callbacks:
             return []
-        to_trigger = []
         port_value = self.port.value
-        if (port_value == InOutInterface.HIGH):
-            to_trigger.extend(self._rising_callbacks)
-            logging.debug(
+        self.last_read_value = port_value
+        to_trigger = self._callbacks_by_value[port_value]
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug(
                 'Event detected on interface (%s) on port (%d). '
-                'Type: RISING.',
+                'Type: %s.',
                 self.port.interface,
-                self.port.number)
-        elif (port_value == InOutInterface.LOW):
-            to_trigger.extend(self._falling_callbacks)
-            logging.debug(
-                'Event detected on interface (%s) on port (%d). '
-                'Type: FALLING.',
-                self.port.interface,
-                self.port.number)
-
-        return to_trigger
\ No newline at end of file
+                self.port.number,
+                'RISING' if port_value == HIGH else 'FALLING')
+        return to_trigger
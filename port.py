@@ -5,71 +5,153 @@ like a proxy for commands that are sent from single port to gpio.
 """
 
 
+import functools
 import logging
+import time
 
 from base import InOutInterface
 
 
+_log = logging.getLogger(__name__)
+
+# Most precise clock available (python 3), used for pulse().
+_clock = getattr(time, 'perf_counter', time.time)
+
+
 class Port(object):
+    __slots__ = (
+        '_interface',
+        'number',
+        '_str',
+        '_get_value',
+        '_is_high',
+        '_is_low',
+        '_set_high',
+        '_set_low',
+    )
+
     def __init__(self, interface, number):
         self._interface = interface
-        self._number = number
+        # Plain attribute rather than a property, as it's read very often.
+        # Treat it as read only.
+        self.number = number
+        # Neither the number nor the interface ever changes.
+        self._str = 'Port id: {} on interface: {}'.format(number, interface)
+        # Interface methods used most often, bound with the port number once
+        # so each call skips the lookups.
+        self._get_value = functools.partial(interface.get_value, number)
+        self._is_high = functools.partial(interface.is_high, number)
+        self._is_low = functools.partial(interface.is_low, number)
+        self._set_high = functools.partial(interface.set_high, number)
+        self._set_low = functools.partial(interface.set_low, number)
 
     def initialize(self):
-        self.set_as_output()
-        self.set_low()
+        # One interface call, so it can set direction and value at once.
+        self._interface.set_output_low(self.number)
 
     def __str__(self):
-        return 'Port id: {} on interface: {}'.format(
-            self._number, self._interface)
-
-    @property
-    def number(self):
-        return self._number
+        return self._str
 
     @property
     def interface(self):
         return self._interface
 
+    @property
+    def chain(self):
+        """Same setters as the port has, returning themselves for chaining.
+
+        > port.chain.set_as_output().set_high()
+        """
+        return _PortChain(self)
+
     @property
     def value(self):
-        return self._interface.get_value(self._number)
+        return self._get_value()
 
     @property
     def is_high(self):
-        return self._interface.is_high(self._number)
+        return self._is_high()
 
     @property
     def is_low(self):
-        return self._interface.is_low(self._number)
+        return self._is_low()
 
     @property
     def is_output(self):
-        return self._interface.is_output(self._number)
+        return self._interface.is_output(self.number)
 
     @property
     def is_input(self):
-        return self._interface.is_input(self._number)
+        return self._interface.is_input(self.number)
 
+    # Ports are often set in tight loops, so the message is formatted (with
+    # __str__ call) and logged only when debug logging is enabled.
     def set_as_output(self):
-        logging.debug('Setting as output: %s', str(self))
-        self._interface.set_as_output(self._number)
-        return self
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug('Setting as output: %s', self)
+        self._interface.set_as_output(self.number)
 
     def set_as_input(self):
-        logging.debug('Setting as input: %s', str(self))
-        self._interface.set_as_input(self._number)
-        return self
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug('Setting as input: %s', self)
+        self._interface.set_as_input(self.number)
 
     def set_high(self):
-        logging.debug('Setting high: %s', str(self))
-        self._interface.set_high(self._number)
-        return self
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug('Setting high: %s', self)
+        self._set_high()
 
     def set_low(self):
-        logging.debug('Setting low: %s', str(self))
-        self._interface.set_low(self._number)
-        return self
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug('Setting low: %s', self)
+        self._set_low()
+
+    @staticmethod
+    def set_group_high(ports):
+        """Sets all given ports high, with one call per interface.
+
+        See InOutInterface.set_ports_high, eg. for MCP23017 ports of one
+        interface it is at most one bus write.
+        """
+        for interface, port_numbers in _group_by_interface(ports):
+            interface.set_ports_high(port_numbers)
+
+    @staticmethod
+    def set_group_low(ports):
+        """Sets all given ports low, with one call per interface."""
+        for interface, port_numbers in _group_by_interface(ports):
+            interface.set_ports_low(port_numbers)
+
+    @staticmethod
+    def read_many(ports):
+        """Returns values of given ports, in the same order.
+
+        Values are read with one get_values call per interface, eg. for
+        MCP23017 ports of one interface it is a single bus read.
+        """
+        ports = list(ports)
+        values_by_interface = {}
+        for interface, port_numbers in _group_by_interface(ports):
+            values_by_interface[interface] = iter(
+                interface.get_values(port_numbers))
+        return [next(values_by_interface[port._interface]) for port in ports]
+
+    def toggle(self):
+        """Inverts the port value."""
+        self._interface.toggle(self.number)
+
+    def pulse(self, width_us):
+        """Inverts the port value and turns it back after width_us.
+
+        It busy waits for width_us microseconds, as sleeping can't be that
+        precise. Meant for short pulses, the CPU is busy meanwhile.
+        """
+        toggle = self._interface.toggle
+        toggle(self.number)
+        deadline = _clock() + width_us / 1000000.0
+        while _clock() < deadline:
+            pass
+        toggle(self.number)
 
     def on_falling(self, callback):
         """Adds callback to be fired when value on port changes 1 -> 0.
@@ -78,7 +160,7 @@ class Port(object):
         1. port instance
         2. value read from port that triggered the callback
         """
-        self._interface.on_falling_detection(self._number, callback)
+        self._interface.on_falling_detection(self.number, callback)
 
     def on_rising(self, callback):
         """Adds callback to be fired when value on port changes 0 -> 1.
@@ -87,8 +169,54 @@ class Port(object):
         1. port instance
         2. value read from port that triggered the callback
         """
-        self._interface.on_rising_detection(self._number, callback)
+        self._interface.on_rising_detection(self.number, callback)
 
     def clear_value_change_listeners(self):
         """Clears all callbacks set with on_falling and on rising methods."""
-        self._interface.clear_read_events(self._number)
+        self._interface.clear_read_events(self.number)
+
+
+class _PortChain(object):
+    """Port setters that can be chained, see Port.chain."""
+
+    __slots__ = ('port',)
+
+    def __init__(self, port):
+        self.port = port
+
+    def set_as_output(self):
+        self.port.set_as_output()
+        return self
+
+    def set_as_input(self):
+        self.port.set_as_input()
+        return self
+
+    def set_high(self):
+        self.port.set_high()
+        return self
+
+    def set_low(self):
+        self.port.set_low()
+        return self
+
+    def toggle(self):
+        self.port.toggle()
+        return self
+
+    def pulse(self, width_us):
+        self.port.pulse(width_us)
+        return self
+
+
+def _group_by_interface(ports):
+    """Returns [(interface, [port numbers])], in order of first ports."""
+    groups = []
+    numbers_by_interface = {}
+    for port in ports:
+        port_numbers = numbers_by_interface.get(port._interface)
+        if port_numbers is None:
+            port_numbers = numbers_by_interface[port._interface] = []
+            groups.append((port._interface, port_numbers))
+        port_numbers.append(port.number)
+    return groups